@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+""" Allows the HLSCLT Command Line Tool to be run with 'python -m hlsclt'.
+
+Copyright (c) 2017 Ben Marshall
+"""
+
+### Imports ###
+from .hlsclt import cli
+
+cli(prog_name='hlsclt')
@@ -8,33 +8,38 @@ Copyright (c) 2017 Ben Marshall
 import click
 import os
 import subprocess
+import time
 from hlsclt.helper_funcs import find_solution_num
-from hlsclt.report_commands.report_commands import open_report
+from hlsclt.report_commands.report_commands import open_report, parse_cosim_report
 import shutil
 
 ### Supporting Functions ###
+# Function to write the project and solution set up commands into a HLS Tcl build script.
+def write_project_setup(file, config, project_name, solution_num, reset):
+    file.write("open_project " + project_name + "\n")
+    file.write("set_top " + config["top_level_function_name"] + "\n")
+    if config.get("cflags","") != "":
+        cf = " -cflags \"%s\"" % config["cflags"]
+    else:
+        cf = ""
+    for src_file in config["src_files"]:
+        file.write("add_files " + config["src_dir_name"] + "/" + src_file + cf + "\n")
+    for tb_file in config["tb_files"]:
+        file.write("add_files -tb " + config["tb_dir_name"] + "/" + tb_file + "\n")
+    if reset:
+        file.write("open_solution -reset \"solution" + str(solution_num) + "\"" + "\n")
+    else:
+        file.write("open_solution \"solution" + str(solution_num) + "\"" + "\n")
+    file.write("set_part " + config["part_name"] + "\n")
+    file.write("create_clock -period " + config["clock_period"] + " -name default" + "\n")
+
 # Function to generate the 'pre-amble' within the HLS Tcl build script.
 def do_start_build_stuff(ctx):
     config = ctx.obj.config
     solution_num = ctx.obj.solution_num
     try:
         file = click.open_file("run_hls.tcl","w")
-        file.write("open_project " + config["project_name"] + "\n")
-        file.write("set_top " + config["top_level_function_name"] + "\n")
-        if config.get("cflags","") != "":
-            cf = " -cflags \"%s\"" % config["cflags"]
-        else:
-            cf = ""
-        for src_file in config["src_files"]:
-            file.write("add_files " + config["src_dir_name"] + "/" + src_file + cf + "\n")
-        for tb_file in config["tb_files"]:
-            file.write("add_files -tb " + config["tb_dir_name"] + "/" + tb_file + "\n")
-        if ctx.params['keep']:
-            file.write("open_solution -reset \"solution" + str(solution_num) + "\"" + "\n")
-        else:
-            file.write("open_solution \"solution" + str(solution_num) + "\"" + "\n")
-        file.write("set_part " + config["part_name"] + "\n")
-        file.write("create_clock -period " + config["clock_period"] + " -name default" + "\n")
+        write_project_setup(file, config, config["project_name"], solution_num, ctx.params['keep'])
         return file
     except (OSError, IOError):
         click.echo("Woah! Couldn't create a Tcl run file in the current folder!")
@@ -49,17 +54,20 @@ def do_default_build(ctx):
     file.write("cosim_design -O -rtl " + config["language"] + "\n")
     file.write("export_design -format ip_catalog" + "\n")
     file.write("export_design -format sysgen" + "\n")
+    ctx.obj.hls_command_present = True
 
 # Function which defines the main actions of the 'csim' command.
 def do_csim_stuff(ctx):
     file = ctx.obj.file
     config = ctx.obj.config
     file.write("csim_design -clean" + (" -compiler clang" if config.get("compiler","") == "clang" else "") + "\n")
+    ctx.obj.hls_command_present = True
 
 # Function which defines the main actions of the 'syn' command.
 def do_syn_stuff(ctx):
     file = ctx.obj.file
     file.write("csynth_design" + "\n")
+    ctx.obj.hls_command_present = True
 
 # Function to perform a search for existing c synthesis results in a specified hls project and solution.
 def check_for_syn_results(proj_name, solution_num, top_level_function_name):
@@ -80,17 +88,146 @@ def syn_lookahead_check(ctx):
         if click.confirm("C Synthesis has not yet been run but is required for the process(es) you have selected.\nWould you like to add it to this run?", default=True):
             click.echo("Adding csynth option.")
             file.write("csynth_design" + "\n")
+            ctx.obj.hls_command_present = True
         else:
             click.echo("Ok, watch out for missing synthesis errors!")
 
+# Function to generate the cosim Tcl command for a given language.
+def get_cosim_command(language,debug):
+    if debug:
+        return "cosim_design -rtl " + language + " -trace_level all" + "\n"
+    else:
+        return "cosim_design -O -rtl " + language + "\n"
+
 # Function which defines the main actions of the 'cosim' command.
-def do_cosim_stuff(ctx,debug):
+def do_cosim_stuff(ctx,debug,language=None):
     config = ctx.obj.config
     file = ctx.obj.file
-    if debug:
-        file.write("cosim_design -rtl " + config["language"] + " -trace_level all" + "\n")
-    else:
-        file.write("cosim_design -O -rtl " + config["language"] + "\n")
+    file.write(get_cosim_command(language or config["language"],debug))
+    ctx.obj.hls_command_present = True
+
+# Callback function used to parse and check the comma separated list of cosim languages.
+def parse_languages(ctx, param, value):
+    if not value:
+        return [ctx.obj.config["language"]]
+    languages = []
+    for language in value.split(","):
+        language = language.strip().lower()
+        if language not in ['vhdl','verilog']:
+            raise click.BadParameter("'" + language + "' is not a valid language, choose from vhdl or verilog.")
+        if language not in languages:
+            languages.append(language)
+    return languages
+
+# Function to get the folder which holds the cloned project for a language specific cosim.
+def get_cosim_clone_dir(config,language):
+    return config["project_name"] + "/cosim_" + language
+
+# Function to clone the synthesized solution and generate a cosim Tcl build script within the clone.
+def do_cosim_clone_stuff(ctx,language):
+    config = ctx.obj.config
+    solution_num = ctx.obj.solution_num
+    clone_dir = get_cosim_clone_dir(config,language)
+    shutil.rmtree(clone_dir, ignore_errors=True)
+    try:
+        shutil.copytree(config["project_name"] + "/solution" + str(solution_num), clone_dir + "/solution" + str(solution_num))
+        file = click.open_file(clone_dir + "/run_hls.tcl","w")
+        write_project_setup(file, config, clone_dir, solution_num, False)
+        file.write(get_cosim_command(language,ctx.obj.cosim_debug))
+        file.write("exit" + "\n")
+        file.close()
+    except (OSError, IOError, shutil.Error):
+        click.echo("Woah! Couldn't clone solution" + str(solution_num) + " for the " + language + " cosimulation!")
+        raise click.Abort()
+    return clone_dir
+
+# Function to run the language specific cosims as parallel HLS processes, limited by the number of jobs.
+def run_parallel_cosims(ctx):
+    pending = list(ctx.obj.cosim_languages)
+    running = {}
+    failed = []
+    devnull = open(os.devnull, "w")
+    try:
+        while pending or running:
+            # Launch new processes whilst there are free job slots.
+            while pending and len(running) < ctx.obj.cosim_jobs:
+                language = pending.pop(0)
+                clone_dir = do_cosim_clone_stuff(ctx,language)
+                click.echo("Starting " + language + " cosimulation, logging to '" + clone_dir + "/vivado_hls.log'")
+                running[language] = subprocess.Popen(["vivado_hls", "-f", clone_dir + "/run_hls.tcl", "-l", clone_dir + "/vivado_hls.log"], stdout=devnull, stderr=subprocess.STDOUT)
+            # Check for finished processes.
+            for language in list(running):
+                returncode = running[language].poll()
+                if returncode is None:
+                    continue
+                del running[language]
+                if returncode != 0:
+                    click.echo("Warning: HLS Process for the " + language + " cosimulation returned an error!")
+                    failed.append(language)
+                else:
+                    click.echo("Finished " + language + " cosimulation.")
+            if running:
+                time.sleep(1)
+    finally:
+        # Don't leave any HLS processes behind if we are exiting early, e.g. on an abort or Ctrl+C.
+        for language in running:
+            click.echo("Stopping " + language + " cosimulation.")
+            running[language].terminate()
+            running[language].wait()
+        devnull.close()
+    return failed
+
+# Function to merge the results of the language specific cosims back into the main solution.
+def merge_cosim_results(ctx,failed):
+    config = ctx.obj.config
+    solution_num = ctx.obj.solution_num
+    destiny = config["project_name"] + "/solution" + str(solution_num)
+    report_name = "/sim/report/" + config["top_level_function_name"] + "_cosim.rpt"
+    report_lines = None
+    result_lines = {}
+    for language in ctx.obj.cosim_languages:
+        clone_dir = get_cosim_clone_dir(config,language)
+        clone_solution = clone_dir + "/solution" + str(solution_num)
+        # Copy the language specific simulation files and reports back into the main solution.
+        try:
+            for sub_dir in ["/sim/" + language, "/sim/report/" + language]:
+                if os.path.isdir(clone_solution + sub_dir):
+                    shutil.rmtree(destiny + sub_dir, ignore_errors=True)
+                    shutil.copytree(clone_solution + sub_dir, destiny + sub_dir)
+        except (OSError, IOError, shutil.Error):
+            click.echo("Woah! Couldn't copy the " + language + " cosimulation results back into solution" + str(solution_num) + "!")
+            raise click.Abort()
+        # Grab the result row for this language from the clone's cosim report.
+        try:
+            cosim_results = parse_cosim_report(clone_solution + report_name)
+            if language in cosim_results:
+                result_lines[language] = cosim_results[language]["line"]
+            if report_lines is None:
+                with click.open_file(clone_solution + report_name,"r") as f:
+                    report_lines = f.readlines()
+                f.close()
+        except (OSError, IOError):
+            pass
+        # Only keep the clone around if it is needed for debugging a failure.
+        if language not in failed:
+            shutil.rmtree(clone_dir, ignore_errors=True)
+    if report_lines is None:
+        click.echo("Warning: Couldn't find any cosim reports to merge!")
+        return
+    # Write out a combined report, replacing each language row with the row from that language's cosim.
+    try:
+        if not os.path.isdir(destiny + "/sim/report"):
+            os.makedirs(destiny + "/sim/report")
+        with click.open_file(destiny + report_name,"w") as f:
+            for line in report_lines:
+                line_elements = [x.strip() for x in line.split('|')]
+                if len(line_elements) > 1 and line_elements[1].lower() in result_lines:
+                    line = result_lines[line_elements[1].lower()]
+                f.write(line)
+        f.close()
+    except (OSError, IOError):
+        click.echo("Woah! Couldn't write the merged cosim report into solution" + str(solution_num) + "!")
+        raise click.Abort()
 
 # Function which defines the main actions of the 'export' command.
 def do_export_stuff(ctx,type,evaluate):
@@ -106,6 +243,7 @@ def do_export_stuff(ctx,type,evaluate):
             file.write("export_design -format ip_catalog" + "\n")
         if "sysgen" in type:
             file.write("export_design -format sysgen" + "\n")
+    ctx.obj.hls_command_present = True
 
 # Function which defines the actions that occur after a HLS build.
 def do_end_build_stuff(ctx,sub_command_returns,report):
@@ -128,7 +266,7 @@ def do_end_build_stuff(ctx,sub_command_returns,report):
             # Must be on the default run, add all stages manually
             sub_command_returns = ['csim','syn','cosim','export']
         for report in sub_command_returns:
-            open_report(ctx,report)
+            open_report(ctx,report,ctx.obj.cosim_languages)
 
 ### Click Command Definitions ###
 # Build group entry point
@@ -152,16 +290,23 @@ def build_end_callback(ctx,sub_command_returns,keep,report):
             do_default_build(ctx)
     ctx.obj.file.write("exit" + "\n")
     ctx.obj.file.close()
-    # Call the Vivado HLS process
-    returncode = subprocess.call(["vivado_hls -f run_hls.tcl"],shell=True)
-    # Check return status of the HLS process.
-    if returncode < 0:
-        raise click.Abort()
-    elif returncode > 0:
-        click.echo("Warning: HLS Process returned an error, skipping report opening!")
-        raise click.Abort()
-    else:
-        do_end_build_stuff(ctx,sub_command_returns,report)
+    # Call the Vivado HLS process, unless every stage has been deferred to the multi-language cosims.
+    if ctx.obj.hls_command_present:
+        returncode = subprocess.call(["vivado_hls -f run_hls.tcl"],shell=True)
+        # Check return status of the HLS process.
+        if returncode < 0:
+            raise click.Abort()
+        elif returncode > 0:
+            click.echo("Warning: HLS Process returned an error, skipping report opening!")
+            raise click.Abort()
+    # Run any multi-language cosims now that the main HLS process has synthesized the solution.
+    if ctx.obj.cosim_languages and len(ctx.obj.cosim_languages) > 1:
+        failed = run_parallel_cosims(ctx)
+        merge_cosim_results(ctx,failed)
+        if failed:
+            click.echo("Warning: Cosimulation failed for " + ", ".join(failed) + ", skipping report opening!")
+            raise click.Abort()
+    do_end_build_stuff(ctx,sub_command_returns,report)
 
 # csim subcommand
 @build.command('csim')
@@ -183,11 +328,19 @@ def syn(ctx):
 # cosim subcommand
 @build.command('cosim')
 @click.option('-d', '--debug', is_flag=True, help='Turns off compile optimisations and enables logging for cosim.')
+@click.option('-l', '--languages', callback=parse_languages, help='Comma separated list of RTL languages to cosimulate, e.g. vhdl,verilog. Defaults to the language in the config file.')
+@click.option('-j', '--jobs', default=1, type=click.IntRange(1, None), help='Number of cosimulations to run in parallel when multiple languages are specified.')
 @click.pass_context
-def cosim(ctx,debug):
-    """Runs the Vivado HLS cosimulation stage."""
+def cosim(ctx,debug,languages,jobs):
+    """Runs the Vivado HLS cosimulation stage. When multiple languages are specified the synthesized solution is cloned for each language and the cosimulations are run as separate HLS processes once the other build stages have finished."""
     syn_lookahead_check(ctx)
-    do_cosim_stuff(ctx,debug)
+    # Record the languages in every case so that the right cosim logs are opened with the report option.
+    ctx.obj.cosim_languages = languages
+    if len(languages) > 1:
+        ctx.obj.cosim_jobs = jobs
+        ctx.obj.cosim_debug = debug
+    else:
+        do_cosim_stuff(ctx,debug,languages[0])
     return 'cosim'
 
 # export subcommand
@@ -4,6 +4,9 @@
 Copyright (c) 2017 Ben Marshall
 """
 
+### Imports ###
+import threading
+
 # Generic error class
 class Error(Exception):
     """Base class for exceptions in this module."""
@@ -22,8 +25,32 @@ class ConfigError(Error):
 
 # Class to hold application specific info within the Click context.
 class hlsclt_internal_object(object):
-    def __init__(self, config={}, solution_num=1, file=None, syn_command_present=False):
+    def __init__(self, config={}, solution_num=1, file=None, syn_command_present=False, hls_command_present=False, cosim_languages=None, cosim_jobs=1, cosim_debug=False):
         self.config = config
         self.solution_num = solution_num
         self.file=file
         self.syn_command_present = syn_command_present
+        self.hls_command_present = hls_command_present
+        self.cosim_languages = cosim_languages
+        self.cosim_jobs = cosim_jobs
+        self.cosim_debug = cosim_debug
+
+# Class to hold a single build request within the build queue daemon.
+class hlsclt_queue_job(object):
+    def __init__(self, job_id, key=None, seats=1, priority=0):
+        self.job_id = job_id
+        self.key = key
+        self.seats = seats
+        self.priority = priority
+        self.running = False
+
+# Class to hold the shared state of the build queue daemon.
+class hlsclt_queue_state(object):
+    def __init__(self, max_jobs=1):
+        self.max_jobs = max_jobs
+        self.seats_in_use = 0
+        self.condition = threading.Condition()
+        self.queue = []
+        self.running_keys = {}
+        self.results = {}
+        self.job_count = 0
@@ -64,6 +64,19 @@ def parse_config_vars(config_loaded, config, errors):
     for name in del_list:
         del config[name]
 
+# Function to load the local config file on top of the defaults, exiting if there are any errors.
+def load_config():
+    config = generate_default_config();
+    config_loaded = get_vars_from_file('hls_config.py')
+    errors = []
+    parse_config_vars(config_loaded, config, errors)
+    if len(errors) != 0:
+        for err in errors:
+            print(err)
+        print("Config Errors, exiting...")
+        raise click.Abort()
+    return config
+
 # Function to find the highest solution number within a HLS project.
 def find_solution_num(ctx):
     config = ctx.obj.config
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+""" Build queue subcommands for HLSCLT.
+
+Copyright (c) 2017 Ben Marshall
+"""
+
+### Imports ###
+import click
+import os
+import sys
+import pwd
+import grp
+import stat
+import json
+import struct
+import socket
+import hashlib
+import heapq
+import shutil
+import subprocess
+import tempfile
+import threading
+from hlsclt.classes import hlsclt_internal_object, hlsclt_queue_job, hlsclt_queue_state
+from hlsclt.helper_funcs import load_config, find_solution_num
+
+### Supporting Functions ###
+# Solution folders produced by each build stage, these are the results handed on to identical requests.
+stage_result_dirs = {
+    "csim" : ["csim"],
+    "syn" : ["syn", ".autopilot"],
+    "cosim" : ["sim"],
+    "export" : ["impl"],
+}
+
+# Function to send a single JSON encoded message over a queue socket.
+def send_queue_message(connection, message):
+    connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+# Function to read a single JSON encoded message from a queue socket, returns None if the socket has closed.
+def read_queue_message(reader):
+    line = reader.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+# Function to work out how many job slots a build needs, a parallel cosim uses one slot per HLS process.
+def get_required_seats(stages):
+    seats = 1
+    for i, arg in enumerate(stages):
+        value = None
+        if arg in ["-j", "--jobs"] and i + 1 < len(stages):
+            value = stages[i + 1]
+        elif arg.startswith("--jobs="):
+            value = arg[len("--jobs="):]
+        elif arg.startswith("-j") and not arg.startswith("--"):
+            value = arg[2:]
+        try:
+            seats = max(seats, int(value))
+        except (TypeError, ValueError):
+            pass
+    return seats
+
+# Function to check whether the results of a build only depend on its sources, config and stages.
+def is_reusable_request(stages):
+    # Keeping solutions starts a new solution number, which depends on what is already in the project folder.
+    if any(arg == "--keep" or (arg.startswith("-") and not arg.startswith("--") and "k" in arg) for arg in stages):
+        return False
+    # Cosim and export without syn build on whatever synthesis already exists in the project folder.
+    if "syn" not in stages and ("cosim" in stages or "export" in stages):
+        return False
+    return any(stage in stage_result_dirs for stage in stages)
+
+# Function to generate a hash which identifies a build request from its sources, config, target solution and build stages.
+def hash_build_request(config, solution_num, stages):
+    hasher = hashlib.sha1()
+    files_to_hash = ["hls_config.py"]
+    for directory in [config["src_dir_name"], config["tb_dir_name"]]:
+        for root, dirs, files in os.walk(directory):
+            # Walk in a fixed order so that the same tree always gives the same hash.
+            dirs.sort()
+            for name in sorted(files):
+                files_to_hash.append(os.path.join(root, name))
+    for filename in files_to_hash:
+        hasher.update(filename.encode("utf-8"))
+        with open(filename, "rb") as f:
+            hasher.update(f.read())
+    # The project name isn't included as it defaults to the name of the checkout folder.
+    hasher.update(("solution" + str(solution_num) + " " + " ".join(stages)).encode("utf-8"))
+    return hasher.hexdigest()
+
+# Function to get the folder which holds the saved results of a build request.
+def get_job_results_dir(config, key):
+    return config["project_name"] + "/queue_results/" + key
+
+# Function to remove the oldest saved results of a project, keeping only the most recent ones.
+def prune_job_results(config, retain):
+    results_root = config["project_name"] + "/queue_results"
+    if not os.path.isdir(results_root):
+        return
+    results_dirs = sorted([results_root + "/" + name for name in os.listdir(results_root)], key=os.path.getmtime, reverse=True)
+    for results_dir in results_dirs[retain:]:
+        shutil.rmtree(results_dir, ignore_errors=True)
+
+# Function to save a copy of the results of a finished build, so that later changes to the project don't affect them.
+def save_job_results(config, solution_num, key, stages):
+    solution = config["project_name"] + "/solution" + str(solution_num)
+    results_dir = get_job_results_dir(config, key)
+    shutil.rmtree(results_dir, ignore_errors=True)
+    # Save the solution set up files, needed if the results are handed to a project which doesn't exist yet...
+    os.makedirs(results_dir + "/solution")
+    if os.path.isfile(config["project_name"] + "/hls.app"):
+        shutil.copyfile(config["project_name"] + "/hls.app", results_dir + "/hls.app")
+    for name in os.listdir(solution):
+        if os.path.isfile(solution + "/" + name):
+            shutil.copyfile(solution + "/" + name, results_dir + "/solution/" + name)
+    # ... then the copy of the sources made at the end of every build...
+    if os.path.isdir(solution + "/src"):
+        shutil.copytree(solution + "/src", results_dir + "/solution/src")
+    # ... and then only the folders produced by the stages which were run.
+    for stage in stages:
+        for sub_dir in stage_result_dirs.get(stage, []):
+            if os.path.isdir(solution + "/" + sub_dir) and not os.path.isdir(results_dir + "/solution/" + sub_dir):
+                shutil.copytree(solution + "/" + sub_dir, results_dir + "/solution/" + sub_dir)
+    return os.path.abspath(results_dir)
+
+# Function to copy the saved results of an identical build into our own solution.
+def copy_job_results(config, solution_num, results_dir):
+    solution = config["project_name"] + "/solution" + str(solution_num)
+    if not os.path.isdir(solution):
+        # A new project, the request key means the results were also built into the first solution.
+        if os.path.isdir(config["project_name"]) and glob_solutions(config):
+            click.echo("Error: Project folder already holds solutions which the reused results don't, refusing to copy them.")
+            raise click.Abort()
+        shutil.copytree(results_dir + "/solution", solution)
+        if os.path.isfile(results_dir + "/hls.app") and not os.path.isfile(config["project_name"] + "/hls.app"):
+            shutil.copyfile(results_dir + "/hls.app", config["project_name"] + "/hls.app")
+        return
+    # An existing solution, only replace the folders produced by the build stages and leave everything else alone.
+    for name in os.listdir(results_dir + "/solution"):
+        if os.path.isdir(results_dir + "/solution/" + name):
+            shutil.rmtree(solution + "/" + name, ignore_errors=True)
+            shutil.copytree(results_dir + "/solution/" + name, solution + "/" + name)
+
+# Function to list the existing solution folders of a project.
+def glob_solutions(config):
+    return [name for name in os.listdir(config["project_name"]) if name.startswith("solution") and os.path.isdir(config["project_name"] + "/" + name)]
+
+# Function to find the saved results for a request key, forgetting any which have since been removed.
+def find_job_results(state, key):
+    if key is None or key not in state.results:
+        return None
+    if not os.path.isdir(state.results[key][0]):
+        del state.results[key]
+        return None
+    return state.results[key]
+
+# Function to get the user id of the process on the other end of a queue socket, None if it can't be found.
+def get_peer_uid(connection):
+    try:
+        credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    except (AttributeError, socket.error):
+        return None
+    return struct.unpack("3i", credentials)[1]
+
+# Function to get the name of a user for telling others whose results they are reusing.
+def get_user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+# Function to check that reported results are a real folder owned by the user who ran the build.
+def check_job_results(results_dir, uid):
+    if uid is None or not os.path.isabs(results_dir):
+        return False
+    try:
+        results_stat = os.lstat(results_dir)
+    except (OSError, IOError):
+        return False
+    return stat.S_ISDIR(results_stat.st_mode) and results_stat.st_uid == uid
+
+# Function to pick the job which gets the next free job slots.
+def next_queued_job(state):
+    for entry in sorted(state.queue):
+        job = entry[2]
+        # Jobs waiting on an identical build don't hold up the rest of the queue.
+        if job.key is not None and job.key in state.running_keys:
+            continue
+        return job
+    return None
+
+# Function to remove a job from the queue.
+def remove_queued_job(state, job):
+    state.queue = [entry for entry in state.queue if entry[2] is not job]
+    heapq.heapify(state.queue)
+
+# Function which handles a single client of the daemon. The daemon only hands out job slots and keeps track of
+# where the results of each request are saved, the client runs the build and copies any results as its own user.
+def handle_queue_client(state, connection):
+    reader = connection.makefile("rb")
+    job = None
+    uid = get_peer_uid(connection)
+    try:
+        request = read_queue_message(reader)
+        if request is None:
+            return
+        key = request.get("key")
+        if key is not None and (len(key) != 40 or not all(c in "0123456789abcdef" for c in key)):
+            raise ValueError("invalid request key")
+        seats = int(request["seats"])
+        if seats < 1 or seats > state.max_jobs:
+            send_queue_message(connection, {"state" : "error", "message" : "Build needs " + str(seats) + " job slot(s) but the queue only has " + str(state.max_jobs) + "."})
+            return
+        with state.condition:
+            state.job_count += 1
+            job = hlsclt_queue_job(state.job_count, key, seats, int(request["priority"]))
+            # Highest priority first, then first come first served.
+            heapq.heappush(state.queue, (-job.priority, job.job_id, job))
+            send_queue_message(connection, {"state" : "queued", "job" : job.job_id, "position" : len(state.queue)})
+            while True:
+                results = find_job_results(state, key)
+                if results is not None:
+                    remove_queued_job(state, job)
+                    send_queue_message(connection, {"state" : "reuse", "job" : job.job_id, "results" : results[0], "owner" : get_user_name(results[1])})
+                    return
+                if next_queued_job(state) is job and state.seats_in_use + job.seats <= state.max_jobs:
+                    remove_queued_job(state, job)
+                    state.seats_in_use += job.seats
+                    job.running = True
+                    if key is not None:
+                        state.running_keys[key] = job
+                    break
+                state.condition.wait()
+        click.echo("Starting job " + str(job.job_id) + " using " + str(job.seats) + " job slot(s).")
+        send_queue_message(connection, {"state" : "run", "job" : job.job_id})
+        # The slots are held until the client reports back, or disconnects.
+        message = read_queue_message(reader)
+        if message is not None and message.get("returncode") == 0 and key is not None and message.get("results"):
+            # Only results which belong to the user who ran the build are handed on, along with who that was.
+            if check_job_results(message["results"], uid):
+                with state.condition:
+                    state.results[key] = (message["results"], uid)
+            else:
+                click.echo("Warning: Ignoring results for job " + str(job.job_id) + " which aren't owned by the user who ran it.")
+        click.echo("Finished job " + str(job.job_id) + ".")
+    except (socket.error, ValueError, KeyError, TypeError) as err:
+        click.echo("Warning: Dropped a build request: " + str(err))
+    finally:
+        if job is not None:
+            with state.condition:
+                if job.running:
+                    state.seats_in_use -= job.seats
+                    if state.running_keys.get(job.key) is job:
+                        del state.running_keys[job.key]
+                else:
+                    remove_queued_job(state, job)
+                state.condition.notify_all()
+        connection.close()
+
+# Function to check for a daemon which is already listening on the socket, removing the socket if it is stale.
+def check_for_running_daemon(socket_path):
+    if not os.path.exists(socket_path):
+        return
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except socket.error:
+        os.remove(socket_path)
+        return
+    finally:
+        connection.close()
+    click.echo("Error: A build queue is already running on '" + socket_path + "'.")
+    raise click.Abort()
+
+# Function which runs the build queue daemon until it is interrupted.
+def serve_build_queue(socket_path, max_jobs, mode, group):
+    check_for_running_daemon(socket_path)
+    state = hlsclt_queue_state(max_jobs)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        # Connecting to the socket needs write permission, so set who can submit builds rather than relying on the umask.
+        if group is not None:
+            os.chown(socket_path, -1, grp.getgrnam(group).gr_gid)
+        os.chmod(socket_path, mode)
+        server.listen(16)
+    except KeyError:
+        server.close()
+        os.remove(socket_path)
+        click.echo("Error: Can't find a group called '" + group + "'.")
+        raise click.Abort()
+    except (socket.error, OSError) as err:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        click.echo("Error: Couldn't open a socket at '" + socket_path + "': " + str(err))
+        raise click.Abort()
+    click.echo("Build queue listening on '" + socket_path + "' with " + str(max_jobs) + " job slot(s), press Ctrl+C to stop.")
+    try:
+        while True:
+            connection = server.accept()[0]
+            handler = threading.Thread(target=handle_queue_client, args=(state, connection))
+            handler.daemon = True
+            handler.start()
+    except KeyboardInterrupt:
+        click.echo("Shutting down build queue.")
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+# Function to submit a build request to the daemon, then either run the build or reuse the results of an identical one.
+def submit_build_request(ctx, socket_path, priority, stages, retain):
+    config = ctx.obj.config
+    solution_num = find_solution_num(ctx)
+    key = hash_build_request(config, solution_num, stages) if is_reusable_request(stages) else None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except socket.error:
+        click.echo("Error: Can't connect to a build queue at '" + socket_path + "', have you started one with 'hlsclt queue serve'?")
+        raise click.Abort()
+    try:
+        send_queue_message(connection, {"key" : key, "seats" : get_required_seats(stages), "priority" : priority})
+        reader = connection.makefile("rb")
+        while True:
+            message = read_queue_message(reader)
+            if message is None:
+                click.echo("Error: Lost connection to the build queue!")
+                raise click.Abort()
+            if message["state"] == "error":
+                click.echo("Error: " + message["message"])
+                raise click.Abort()
+            elif message["state"] == "queued":
+                click.echo("Build queued as job " + str(message["job"]) + ", position " + str(message["position"]) + " in the queue.")
+            elif message["state"] == "reuse":
+                click.echo("An identical build has already been run by " + message["owner"] + ", reusing their results from '" + message["results"] + "'.")
+                try:
+                    copy_job_results(config, solution_num, message["results"])
+                except (OSError, IOError, shutil.Error):
+                    click.echo("Woah! Couldn't copy the reused results into solution" + str(solution_num) + "!")
+                    raise click.Abort()
+                return
+            elif message["state"] == "run":
+                click.echo("Running build as job " + str(message["job"]) + ".")
+                # Run the build from the same install of hlsclt as this command.
+                returncode = subprocess.call([sys.executable, "-m", "hlsclt", "build"] + stages)
+                results_dir = None
+                if returncode == 0 and key is not None and retain > 0:
+                    try:
+                        results_dir = save_job_results(config, solution_num, key, stages)
+                        prune_job_results(config, retain)
+                    except (OSError, IOError, shutil.Error):
+                        click.echo("Warning: Couldn't save the build results for reuse by identical builds.")
+                send_queue_message(connection, {"returncode" : returncode, "results" : results_dir})
+                if returncode != 0:
+                    click.echo("Warning: Queued build job " + str(message["job"]) + " returned an error!")
+                    raise click.Abort()
+                return
+    finally:
+        connection.close()
+
+### Click Command Definitions ###
+# Option shared by the queue commands to locate the daemon socket.
+socket_option = click.option('-S', '--socket', 'socket_path', default=os.path.join(tempfile.gettempdir(), "hlsclt_queue.sock"),
+                envvar='HLSCLT_QUEUE_SOCKET', show_default=True, help='Path of the local socket used by the build queue.')
+
+# Queue group entry point
+@click.group('queue', short_help='Share a build queue between users of a build host.')
+def queue():
+    """Commands for running and submitting to a shared local build queue, which limits the number of concurrent HLS processes on a host and reuses the results of identical build requests."""
+    pass
+
+# Callback function used to parse an octal file mode.
+def parse_mode(ctx, param, value):
+    try:
+        return int(value, 8)
+    except ValueError:
+        raise click.BadParameter("'" + value + "' is not an octal file mode, e.g. 660.")
+
+# serve subcommand
+@queue.command('serve')
+@socket_option
+@click.option('-j', '--jobs', default=1, type=click.IntRange(1, None), help='Maximum number of HLS processes to run at once, e.g. the number of available HLS license seats.')
+@click.option('-m', '--mode', default='666', show_default=True, callback=parse_mode, help='Octal permissions of the socket, only users with write permission can submit builds.')
+@click.option('-g', '--group', default=None, help='Group to give the socket, e.g. to only allow a group of users with --mode 660.')
+def serve(socket_path, jobs, mode, group):
+    """Runs the build queue daemon. The daemon only hands out job slots, builds are run by the submitting user."""
+    serve_build_queue(socket_path, jobs, mode, group)
+
+# submit subcommand
+@queue.command('submit', context_settings=dict(ignore_unknown_options=True))
+@socket_option
+@click.option('-p', '--priority', default=0, help='Priority of the build, higher priority builds run first.')
+@click.option('-r', '--retain', default=3, show_default=True, type=click.IntRange(0, None), help='Number of saved build results to keep in the project for reuse by identical builds.')
+@click.argument('stages', nargs=-1, required=True, type=click.UNPROCESSED)
+@click.pass_context
+def submit(ctx, socket_path, priority, retain, stages):
+    """Waits for a job slot in the build queue and then runs the build, or reuses the results of an identical build. STAGES are passed on to 'hlsclt build', e.g. 'hlsclt queue submit -p 1 -- syn cosim -l vhdl,verilog -j 2'. A parallel cosim takes one job slot for each of its jobs."""
+    ctx.obj = hlsclt_internal_object(load_config())
+    submit_build_request(ctx, socket_path, priority, list(stages), retain)
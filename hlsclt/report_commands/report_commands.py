@@ -9,6 +9,7 @@ import click
 import os
 import subprocess
 from glob import glob
+from xml.etree import ElementTree
 from hlsclt.helper_funcs import find_solution_num
 
 ### Supporting Functions ###
@@ -20,8 +21,11 @@ def check_for_project(ctx):
         raise click.Abort()
 
 # Function for opening reports.
-def open_report(ctx,report):
+def open_report(ctx,report,languages=None):
     config = ctx.obj.config
+    # Cosim logs are opened for every language which was cosimulated, the config language by default.
+    if not languages:
+        languages = [config["language"]]
     solution_num = ctx.obj.solution_num
     report_files = []
     if report == 'csim':
@@ -30,7 +34,8 @@ def open_report(ctx,report):
         report_files.append(config["project_name"] + "/solution" + str(solution_num) + "/syn/report/" + config["top_level_function_name"] + "_csynth.rpt")
     elif report == 'cosim':
         report_files.append(config["project_name"] + "/solution" + str(solution_num) + "/sim/report/" + config["top_level_function_name"] + "_cosim.rpt")
-        report_files.append(config["project_name"] + "/solution" + str(solution_num) + "/sim/report/" + config["language"] + "/" + config["top_level_function_name"] + ".log")
+        for language in languages:
+            report_files.append(config["project_name"] + "/solution" + str(solution_num) + "/sim/report/" + language + "/" + config["top_level_function_name"] + ".log")
     elif report == 'export':
         report_files.append(config["project_name"] + "/solution" + str(solution_num) + "/impl/report/" + config["language"] + "/" + config["top_level_function_name"] + "_export.rpt")
     for file in report_files:
@@ -43,6 +48,35 @@ def open_project_in_gui(ctx):
     config = ctx.obj.config
     hls_process = subprocess.Popen(["vivado_hls", "-p", config["project_name"]])
 
+# Function to parse the per-language result rows out of a cosim report.
+def parse_cosim_report(filename):
+    # The result table in the cosim report is typically assembled as follows:
+    #
+    # +--------+--------+-----+-----+-----+-----+-----+-----+
+    # |        |        |      Latency    |     Interval    |
+    # +  RTL   + Status +-----+-----+-----+-----+-----+-----+
+    # |        |        | min | avg | max | min | avg | max |
+    # +--------+--------+-----+-----+-----+-----+-----+-----+
+    # |    VHDL|    Pass|    1|    1|    1|   NA|   NA|   NA|
+    # | Verilog|      NA|   NA|   NA|   NA|   NA|   NA|   NA|
+    # +--------+--------+-----+-----+-----+-----+-----+-----+
+    #
+    # Returns a dictionary keyed on language containing the raw row and the parsed results.
+    cosim_results = {}
+    with click.open_file(filename,"r") as f:
+        for line in f:
+            line_elements = [x.strip() for x in line.split('|')]
+            if len(line_elements) < 10 or line_elements[1].lower() not in ['vhdl','verilog','systemc']:
+                continue
+            cosim_results[line_elements[1].lower()] = {
+                "line" : line,
+                "status" : line_elements[2],
+                "latency" : line_elements[3:6],
+                "interval" : line_elements[6:9],
+            }
+    f.close()
+    return cosim_results
+
 # Function for gathering the project status
 def gather_project_status(ctx):
     config = ctx.obj.config
@@ -67,16 +101,14 @@ def gather_project_status(ctx):
         project_status.append('syn_done')
     # Pull details from cosim report
     try:
-        with click.open_file(config["project_name"] + "/solution" + str(solution_num) + "/sim/report/" + config["top_level_function_name"] + "_cosim.rpt","r") as f:
-            # search through cosim report to find out pass/fail status for each language
-            for line in f:
-                if config["language"] in line.lower():
-                    if "pass" in line.lower():
-                        project_status.append('cosim_pass')
-                    elif "fail" in line.lower():
-                        project_status.append('cosim_fail')
-            project_status.append('cosim_done')
-        f.close()
+        cosim_results = parse_cosim_report(config["project_name"] + "/solution" + str(solution_num) + "/sim/report/" + config["top_level_function_name"] + "_cosim.rpt")
+        # The cosim only passes if every language which has been cosimulated passed.
+        cosim_statuses = [result["status"].lower() for result in cosim_results.values() if result["status"].lower() != "na"]
+        if any("fail" in cosim_status for cosim_status in cosim_statuses):
+            project_status.append('cosim_fail')
+        elif any("pass" in cosim_status for cosim_status in cosim_statuses):
+            project_status.append('cosim_pass')
+        project_status.append('cosim_done')
     except (OSError, IOError):
         pass
     except:
@@ -108,6 +140,17 @@ def print_project_status(ctx, stats):
     click.echo("  C Simulation: " + (click.style("Pass", fg='green') if "csim_pass" in project_status else (click.style("Fail", fg='red') if "csim_fail" in project_status else (click.style("Run (Can't get status)", fg='yellow') if "csim_done" in project_status else click.style("Not Run", fg='yellow')))))
     click.echo("  C Synthesis:  " + (click.style("Run", fg='green') if "syn_done" in project_status else click.style("Not Run", fg='yellow')))
     click.echo("  Cosimulation: " + (click.style("Pass", fg='green') if "cosim_pass" in project_status else (click.style("Fail", fg='red') if "cosim_fail" in project_status else (click.style("Run (Can't get status)", fg='yellow') if "cosim_done" in project_status else click.style("Not Run", fg='yellow')))))
+    # Show the results for every language which has been cosimulated, e.g. after a multi-language cosim run.
+    try:
+        cosim_results = parse_cosim_report(config["project_name"] + "/solution" + str(solution_num) + "/sim/report/" + config["top_level_function_name"] + "_cosim.rpt")
+        for language in sorted(cosim_results):
+            result = cosim_results[language]
+            if result["status"].lower() == "na":
+                continue
+            click.echo("    " + (language + ":").ljust(9) + (click.style(result["status"], fg='green') if "pass" in result["status"].lower() else click.style(result["status"], fg='red')) +
+                " (Latency min/avg/max: " + "/".join(result["latency"]) + " cycles)")
+    except (OSError, IOError):
+        pass
     click.echo("  Export:" )
     click.echo("    IP Catalog:        " + (click.style("Run", fg='green') if "export_ip_done" in project_status else click.style("Not Run", fg='yellow')))
     click.echo("    System Generator:  " + (click.style("Run", fg='green') if "export_sysgen_done" in project_status else click.style("Not Run", fg='yellow')))
@@ -188,20 +231,210 @@ def print_project_status(ctx, stats):
                 except IOError:
                     pass
 
+# Function to convert a latency/interval/trip count value from a report into a number of cycles, None if it is unknown.
+def to_cycles(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# Function to pull the rows of a table following a heading out of a csynth report.
+def read_report_table(report_lines, heading):
+    # Only the first table with a matching heading is read, for the Instance and Loop headings this
+    # is the table within the latency details rather than the one within the utilization details.
+    rows = []
+    in_table = False
+    for line in report_lines:
+        stripped = line.strip()
+        if not in_table:
+            if stripped.startswith(heading):
+                in_table = True
+            continue
+        if stripped.startswith("|"):
+            # Keep the first cell unstripped as the loop nesting is encoded in the leading characters.
+            row = stripped.split("|")[1:-1]
+            rows.append([row[0]] + [x.strip() for x in row[1:]])
+        elif stripped.startswith("+") or (stripped == "" and not rows):
+            continue
+        else:
+            # A blank line after the table, or 'N/A' when there is no table.
+            break
+    return rows
+
+# Function to create a node within the profile call tree.
+def new_profile_node(name, kind, latency, module=None):
+    return {
+        "name" : name,
+        "kind" : kind,
+        "module" : module,
+        "latency" : latency,
+        "calls" : 1,
+        "contribution" : None,
+        "interval" : None,
+        "trip_count" : None,
+        "ii_achieved" : None,
+        "ii_target" : None,
+        "resources" : [],
+        "children" : [],
+    }
+
+# Function to recursively build the profile call tree for a module instance from its csynth reports.
+def build_module_profile(report_dir, module, name, latency):
+    node = new_profile_node(name, "module", latency, module)
+    # Pull the overall latency, interval and resource usage from the module's XML report.
+    try:
+        root = ElementTree.parse(report_dir + "/" + module + "_csynth.xml").getroot()
+        if node["latency"] is None:
+            node["latency"] = to_cycles(root.findtext("PerformanceEstimates/SummaryOfOverallLatency/Worst-caseLatency"))
+        node["interval"] = to_cycles(root.findtext("PerformanceEstimates/SummaryOfOverallLatency/Interval-max"))
+        resources = root.find("AreaEstimates/Resources")
+        if resources is not None:
+            node["resources"] = [(resource.tag, resource.text) for resource in resources]
+    except (OSError, IOError, ElementTree.ParseError):
+        pass
+    # Pull the loop and sub-module details from the module's text report.
+    try:
+        with click.open_file(report_dir + "/" + module + "_csynth.rpt","r") as f:
+            report_lines = f.readlines()
+        f.close()
+    except (OSError, IOError):
+        return node
+    # Loop rows look like '|- Loop 1 |', with nested loops as '| + Loop 1.1 |', '|  ++ Loop 1.1.1 |' etc.
+    #   | Loop Name| min | max | Iteration Latency | II achieved | II target | Trip Count | Pipelined|
+    loop_stack = [node]
+    for row in read_report_table(report_lines, "* Loop:"):
+        loop_name = row[0].strip()
+        if len(row) < 7:
+            continue
+        if loop_name.startswith("-"):
+            depth = 1
+        elif loop_name.startswith("+"):
+            depth = len(loop_name) - len(loop_name.lstrip("+")) + 1
+        else:
+            continue
+        loop = new_profile_node(loop_name.lstrip("-+").strip(), "loop", to_cycles(row[2]))
+        loop["ii_achieved"] = row[4]
+        loop["ii_target"] = row[5]
+        loop["trip_count"] = row[6]
+        del loop_stack[depth:]
+        loop_stack[-1]["children"].append(loop)
+        loop_stack.append(loop)
+    # Instance rows list the sub-modules called by this module along with their latency per call.
+    #   | Instance | Module | Latency min | Latency max | Interval min | Interval max | Pipeline Type |
+    for row in read_report_table(report_lines, "* Instance:"):
+        instance_name = row[0].strip()
+        if len(row) < 4 or instance_name in ["", "Instance"]:
+            continue
+        node["children"].append(build_module_profile(report_dir, row[1], instance_name, to_cycles(row[3])))
+    return node
+
+# Function to work out how many cycles each node of the profile call tree contributes to one call of the top level.
+def compute_profile_contributions(node, calls=1):
+    # A loop's latency covers all of its iterations for one entry into the loop, so a node is entered once for
+    # each iteration of its enclosing loops. A trip count of '?' can't be multiplied up, so it counts as one.
+    node["calls"] = calls
+    node["contribution"] = node["latency"] * calls if node["latency"] is not None else None
+    child_calls = calls
+    if node["kind"] == "loop" and to_cycles(node["trip_count"]) is not None:
+        child_calls = calls * to_cycles(node["trip_count"])
+    for child in node["children"]:
+        compute_profile_contributions(child, child_calls)
+
+# Function to flatten the profile call tree into a list of (path, node) pairs.
+def flatten_profile(node, path=""):
+    nodes = []
+    for child in node["children"]:
+        child_path = path + node["name"] + "/"
+        nodes.append((child_path + child["name"], child))
+        nodes.extend(flatten_profile(child, child_path))
+    return nodes
+
+# Function to sort a list of profile nodes so that the biggest contributors come first.
+def sort_by_contribution(nodes, key=lambda node: node):
+    return sorted(nodes, key=lambda item: key(item)["contribution"] if key(item)["contribution"] is not None else -1, reverse=True)
+
+# Function to format a latency as a string, including the share of the total latency.
+def format_latency(latency, total):
+    if latency is None:
+        return "? cycles"
+    if not total:
+        return str(latency) + " cycles"
+    return str(latency) + " cycles (" + "%.1f" % (100.0 * latency / total) + "%)"
+
+# Function to print a node of the profile call tree and its children, hottest first.
+def print_profile_node(node, total, indent):
+    details = ["contribution " + format_latency(node["contribution"], total), "latency per call " + format_latency(node["latency"], None)]
+    if node["calls"] != 1:
+        details.append("calls " + str(node["calls"]))
+    if node["kind"] == "loop":
+        details.append("trip count " + node["trip_count"])
+        # Flag loops which haven't met their II target.
+        ii = node["ii_achieved"] + "/" + node["ii_target"]
+        ii_achieved = to_cycles(node["ii_achieved"])
+        ii_target = to_cycles(node["ii_target"])
+        details.append("II achieved/target " + (click.style(ii, fg='red') if ii_achieved is not None and ii_target is not None and ii_achieved > ii_target else ii))
+        label = click.style("loop ", fg='cyan') + node["name"]
+    else:
+        if node["interval"] is not None:
+            details.append("interval " + str(node["interval"]) + " cycles")
+        if node["resources"]:
+            details.append(", ".join(resource + " " + str(count) for resource, count in node["resources"]))
+        label = click.style("module ", fg='magenta') + node["name"] + (" (" + node["module"] + ")" if node["module"] != node["name"] else "")
+    click.echo("  " * indent + label + ": " + ", ".join(details))
+    for child in sort_by_contribution(node["children"]):
+        print_profile_node(child, total, indent + 1)
+
+# Function for printing out a profile of where the latency and resources of a solution are spent.
+def print_profile(ctx, top):
+    config = ctx.obj.config
+    solution_num = ctx.obj.solution_num
+    report_dir = config["project_name"] + "/solution" + str(solution_num) + "/syn/report"
+    if not os.path.isfile(report_dir + "/" + config["top_level_function_name"] + "_csynth.rpt"):
+        click.echo("Error: Can't find the C synthesis report for solution" + str(solution_num) + ", have you run the syn build stage?")
+        raise click.Abort()
+    profile = build_module_profile(report_dir, config["top_level_function_name"], config["top_level_function_name"], None)
+    compute_profile_contributions(profile)
+    total = profile["latency"]
+    click.secho("Profile", bold=True)
+    click.echo("  Solution Folder: '" + config["project_name"] + "/solution" + str(solution_num) + "'")
+    click.echo("  Top Level Latency: " + format_latency(total, None))
+    click.echo("  Note: The reports don't say which loop calls a sub-module, so sub-modules are counted once per call of their parent.")
+    # Call tree first, ordered hottest first at each level of the hierarchy...
+    click.secho("Call Tree", bold=True)
+    print_profile_node(profile, total, 1)
+    # ... then a flat list of the hottest loops and modules across the whole design.
+    click.secho("Hotspots", bold=True)
+    hotspots = sort_by_contribution(flatten_profile(profile), key=lambda item: item[1])[:top]
+    if not hotspots:
+        click.echo("  No loops or sub-modules found.")
+    for i, (path, node) in enumerate(hotspots):
+        click.echo("  " + str(i + 1).rjust(2) + ". " + node["kind"].ljust(6) + " " + path + ": " + format_latency(node["contribution"], total) +
+            ", latency per call " + format_latency(node["latency"], None) + (", trip count " + node["trip_count"] if node["kind"] == "loop" else ""))
+
 ### Click Command Definitions ###
 # Report Command
-@click.command('report', short_help='Open reports.')
-@click.option('-s', '--stage', required=True, multiple=True,
+@click.group('report', invoke_without_command=True, short_help='Open reports.')
+@click.option('-s', '--stage', multiple=True,
                 type=click.Choice(['csim','syn','cosim','export']),
                 help='Which build stage to open the report for. Multiple occurences accepted')
 @click.pass_context
 def report(ctx,stage):
     """Opens the Vivado HLS report for the chosen build stages."""
+    if not stage and ctx.invoked_subcommand is None:
+        raise click.UsageError("Missing option \"-s\" / \"--stage\".", ctx)
     check_for_project(ctx)
     ctx.obj.solution_num = find_solution_num(ctx)
     for report in stage:
         open_report(ctx,report)
 
+# profile subcommand
+@report.command('profile')
+@click.option('-n', '--top', default=10, type=click.IntRange(1, None), help='Number of hotspots to list.')
+@click.pass_context
+def profile(ctx,top):
+    """Prints a profile of the latest solution built from the C synthesis reports, showing where the latency and resources are spent with the hottest loops and modules first."""
+    print_profile(ctx,top)
+
 @click.command('open_gui', short_help='Open the Vivado HLS GUI and load the project.')
 @click.pass_context
 def open_gui(ctx):